@@ -0,0 +1,77 @@
+"""
+Helpers shared by the CMR and CMR-STAC ATL06 query scripts: granule name
+parsing and GeoParquet output.
+"""
+
+from typing import List, Tuple
+
+import geopandas as gpd
+import numpy as np
+
+
+# Granule URs follow ATL06_YYYYMMDDhhmmss_ttttccnn_rrr_vv, where tttt is
+# the RGT, cc the cycle and nn the granule region. The layout is fixed
+# width, so the fields sit at fixed character offsets.
+_UR_PREFIX = np.array([ord(c) for c in "ATL06_"], dtype=np.uint32)
+_UR_WIDTH = 29
+_UR_FIELDS = slice(21, 29)
+
+
+def parse_granule_urs(
+    urs: List[str],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Extract RGT, cycle and region from a list of granule URs at once.
+
+    The URs are laid out as a fixed-width character array so the digit
+    fields can be sliced out of every row together.
+
+    Parameters
+    ----------
+    urs : List[str]
+        Granule URs (or STAC item ids) of the form
+        ATL06_YYYYMMDDhhmmss_ttttccnn_rrr_vv
+
+    Returns
+    -------
+    rgt : np.ndarray
+        Reference ground track of each UR, int64
+    cycle : np.ndarray
+        Orbital cycle of each UR, int64
+    region : np.ndarray
+        Granule region of each UR, int64
+    parsed : np.ndarray
+        Boolean mask of the URs that match the ATL06 layout. rgt, cycle
+        and region hold meaningless values where parsed is False.
+    """
+    chars = np.array(urs, dtype=f"U{_UR_WIDTH}").view(np.uint32)
+    chars = chars.reshape(len(urs), _UR_WIDTH)
+    digits = chars - ord("0")
+    is_digit = digits < 10
+
+    parsed = (chars[:, :6] == _UR_PREFIX).all(axis=1)
+    parsed &= is_digit[:, 6:20].all(axis=1) & (chars[:, 20] == ord("_"))
+    parsed &= is_digit[:, _UR_FIELDS].all(axis=1)
+
+    fields = digits[:, _UR_FIELDS].astype(np.int64)
+    rgt = fields[:, 0] * 1000 + fields[:, 1] * 100 + fields[:, 2] * 10 + fields[:, 3]
+    cycle = fields[:, 4] * 10 + fields[:, 5]
+    region = fields[:, 6] * 10 + fields[:, 7]
+    return rgt, cycle, region, parsed
+
+
+def save_to_geoparquet(gdf: gpd.GeoDataFrame, output_path: str):
+    """
+    Save GeoDataFrame to GeoParquet format.
+
+    Parameters
+    ----------
+    gdf : gpd.GeoDataFrame
+        GeoDataFrame to save
+    output_path : str
+        Output file path (should end in .parquet or .geoparquet)
+    """
+    # pyarrow writes the urls lists natively as a list<string> column;
+    # gpd.read_parquet returns each value as a NumPy object array of URLs
+    gdf.to_parquet(output_path, index=False, compression="zstd")
+    print(f"\nSaved {len(gdf)} records to {output_path}")
@@ -6,12 +6,175 @@ with support for orbital cycle and region filtering via native CMR parameters.
 The CMR API has better native support for ICESat-2 orbital parameters than CMR-STAC.
 """
 
+import math
+import random
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from typing import List, Optional, Dict
 import geopandas as gpd
-from shapely.geometry import box, Polygon, LineString
+import numpy as np
+import shapely
+from shapely.geometry import LineString
 import pandas as pd
-from datetime import datetime, timedelta
+import pyproj
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+from atl06_granules import parse_granule_urs, save_to_geoparquet
+
+try:
+    # orjson decodes the large UMM-JSON pages several times faster
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+
+# Parsed once rather than on every GeoDataFrame construction
+_CRS_4326 = pyproj.CRS.from_epsg(4326)
+
+# One pooled session for every CMR request so successive pages reuse the
+# same keep-alive connection instead of repeating the TLS handshake
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=0))
+
+
+def _retry_after_seconds(value: Optional[str]) -> float:
+    """
+    Parse a Retry-After header (delta-seconds or HTTP-date) into seconds.
+
+    Missing, unparseable and non-finite values are treated as no hint (0).
+    """
+    if not value:
+        return 0.0
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        return max(0.0, seconds) if math.isfinite(seconds) else 0.0
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0.0
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def _fetch_page(
+    cmr_url: str,
+    params: Dict,
+    headers: Dict,
+    max_retries: int = 6,
+    base_delay: float = 0.5,
+    max_delay: float = 30.0,
+):
+    """
+    Fetch one page of CMR results.
+
+    Server errors, rate limiting (429) and dropped connections are retried
+    up to max_retries times with decorrelated-jitter backoff, so concurrent
+    callers spread their retries out instead of waking up in lockstep.
+    A Retry-After header from CMR is honoured when it asks for a longer wait,
+    up to max_delay, so the worst-case total wait stays bounded.
+
+    Returns the page's items, the total hit count, and the search-after
+    cursor for the next page (None when CMR does not send one).
+    """
+    delay = base_delay
+    for attempt in range(max_retries + 1):
+        retry_after = 0.0
+        try:
+            response = _SESSION.get(cmr_url, params=params, headers=headers, timeout=30)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+        else:
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable or attempt == max_retries:
+                break
+            retry_after = _retry_after_seconds(response.headers.get("Retry-After"))
+        delay = min(max_delay, random.uniform(base_delay, delay * 3))
+        time.sleep(max(min(retry_after, max_delay), delay))
+    response.raise_for_status()
+    total_hits = int(response.headers.get("CMR-Hits", 0))
+    search_after = response.headers.get("CMR-Search-After")
+    return _json_loads(response.content).get("items", []), total_hits, search_after
+
+
+def _iter_pages(
+    cmr_url: str,
+    params: Dict,
+    headers: Dict,
+    page_size: int,
+    max_granules: Optional[int] = None,
+):
+    """
+    Yield pages of CMR granule items as they are retrieved.
+
+    Pages are followed with CMR's search-after cursor: every response
+    carries a CMR-Search-After header that is sent back for the next page.
+    Unlike offset paging, late pages cost CMR no more than early ones and
+    there is no cap on how deep we can page. Callers consume each page
+    before the next is fetched, so the raw items of the whole query are
+    never held at once.
+    """
+    n_retrieved = 0
+    total_hits = None
+    search_after = None
+
+    while True:
+        page_headers = headers
+        if search_after is not None:
+            page_headers = {**headers, "CMR-Search-After": search_after}
+        items, hits, search_after = _fetch_page(cmr_url, params, page_headers)
+
+        # Get total number of hits from header (only on first request)
+        if total_hits is None:
+            total_hits = hits
+            print(f"  Total matching granules in CMR: {total_hits}")
+
+        if not items:
+            break
+
+        # Check if we've reached the max_granules limit
+        if max_granules and n_retrieved + len(items) >= max_granules:
+            items = items[:max_granules - n_retrieved]
+            n_retrieved += len(items)
+            print(f"  Retrieved {n_retrieved} of {total_hits} granules...", end="\r")
+            print(f"\n  Stopped at max_granules limit: {max_granules}")
+            yield items
+            break
+
+        n_retrieved += len(items)
+
+        # Update progress
+        print(f"  Retrieved {n_retrieved} of {total_hits} granules...", end="\r")
+
+        yield items
+
+        # Check if there are more pages
+        if search_after is None or len(items) < page_size or n_retrieved >= total_hits:
+            break
+
+    print(f"Retrieved {n_retrieved} granules from CMR")
+
+
+def _centerline(coords: np.ndarray) -> LineString:
+    """
+    Approximate the centerline of a ground track polygon.
+
+    Connects the midpoints of opposite polygon vertices; for simple
+    four-point polygons, connects the midpoints of opposite edges.
+    """
+    n_points = len(coords)
+    if n_points > 4:
+        # For complex polygons, pair each vertex with its mirror from the end
+        half = n_points // 2
+        return LineString((coords[:half] + coords[:-half - 1:-1]) * 0.5)
+    # Simple polygon - just connect opposite midpoints
+    return LineString((coords[0:2] + coords[2:4]) * 0.5)
 
 
 def query_atl06_cmr(
@@ -118,89 +281,110 @@ def query_atl06_cmr(
     if rgts:
         print(f"  RGTs: {rgts}")
     
-    all_granules = []
     headers = {"Accept": "application/vnd.nasa.cmr.umm_json+json"}
 
-    # Add offset for pagination
-    params["offset"] = 0
-    total_hits = None
-
-    # Fetch all pages using offset-based pagination
-    while True:
-        response = requests.get(cmr_url, params=params, headers=headers)
-        response.raise_for_status()
-
-        # Get total number of hits from header (only on first request)
-        if total_hits is None:
-            total_hits = int(response.headers.get("CMR-Hits", 0))
-            print(f"  Total matching granules in CMR: {total_hits}")
-
-        data = response.json()
-        items = data.get("items", [])
-
-        if not items:
-            break
-
-        all_granules.extend(items)
-
-        # Update progress
-        print(f"  Retrieved {len(all_granules)} of {total_hits} granules...", end="\r")
-
-        # Check if we've reached the max_granules limit
-        if max_granules and len(all_granules) >= max_granules:
-            print(f"\n  Stopped at max_granules limit: {max_granules}")
-            all_granules = all_granules[:max_granules]
-            break
+    # Filter each page by cycle, region and RGT as it arrives and collect the
+    # matches as per-column lists; boundary points go into one flat array so
+    # shapely builds all geometries in a few vectorized calls after the loop.
+    granule_ids = []
+    granule_rgts = []
+    granule_cycles = []
+    granule_regions = []
+    begin_dates = []
+    end_dates = []
+    url_lists = []
+    ring_coords = []
+    ring_index = []
+    ring_rows = []
+    rect_bounds = []
+    rect_rows = []
+    n_matched = 0
+    for items in _iter_pages(cmr_url, params, headers, page_size, max_granules):
+        urs = [granule.get("umm", {}).get("GranuleUR", "") for granule in items]
+        page_rgts, page_cycles, page_regions, keep = parse_granule_urs(urs)
+        for k in np.flatnonzero(~keep):
+            print(f"Warning: Could not parse granule UR {urs[k]}")
+
+        # Check if cycle matches (if specified)
+        if cycle is not None:
+            keep &= page_cycles == cycle
+
+        # Filter by region (if specified)
+        if regions is not None:
+            keep &= np.isin(page_regions, list(regions))
+
+        # Filter by RGT if specified
+        if rgts:
+            keep &= np.isin(page_rgts, list(rgts))
+
+        page_rgts = page_rgts.tolist()
+        page_cycles = page_cycles.tolist()
+        page_regions = page_regions.tolist()
+        for k in np.flatnonzero(keep).tolist():
+            n_matched += 1
+            umm = items[k].get("umm", {})
+            granule_id = urs[k]
+
+            # Get bounding box from spatial extent
+            spatial_extent = umm.get("SpatialExtent", {})
+            horiz_spatial = spatial_extent.get("HorizontalSpatialDomain", {})
+            geometry_obj = horiz_spatial.get("Geometry", {})
+
+            # Try to get geometry from GPolygons (UMM-JSON format)
+            gpolygons = geometry_obj.get("GPolygons", [])
+            if gpolygons:
+                # Get polygon points
+                boundary_points = gpolygons[0].get("Boundary", {}).get("Points", [])
+                if not boundary_points:
+                    continue
 
-        # Check if there are more pages
-        if len(items) < page_size or len(all_granules) >= total_hits:
-            break
+                # Extract coordinates
+                coords = [(p["Longitude"], p["Latitude"]) for p in boundary_points
+                          if "Longitude" in p and "Latitude" in p]
 
-        # Update offset for next page
-        params["offset"] += len(items)
-    
-    print(f"Retrieved {len(all_granules)} granules from CMR")
-    
-    # Filter by region and optionally by RGT from granule names
-    filtered_granules = []
-    for granule in all_granules:
-        umm = granule.get("umm", {})
-        granule_ur = umm.get("GranuleUR", "")
-        
-        # Parse granule filename
-        # Format: ATL06_YYYYMMDDhhmmss_ttttccnn_rrr_vv
-        try:
-            parts = granule_ur.split("_")
-            if len(parts) >= 3:
-                rgt_cycle_region = parts[2]
-                
-                # Extract RGT (first 4 digits)
-                granule_rgt = int(rgt_cycle_region[0:4])
-                
-                # Extract cycle (next 2 digits)
-                granule_cycle = int(rgt_cycle_region[4:6])
-                
-                # Extract region (last 2 digits)
-                granule_region = int(rgt_cycle_region[6:8])
-
-                # Check if cycle matches (if specified)
-                if cycle is not None and granule_cycle != cycle:
+                if len(coords) < 3:
                     continue
 
-                # Filter by region (if specified)
-                if regions is not None and granule_region not in regions:
+                ring_index.extend([len(ring_rows)] * len(coords))
+                ring_coords.extend(coords)
+                ring_rows.append(len(granule_ids))
+            else:
+                # Fallback to BoundingRectangles if available
+                bounding_rectangles = geometry_obj.get("BoundingRectangles", [])
+                if not bounding_rectangles:
                     continue
 
-                # Filter by RGT if specified
-                if rgts and granule_rgt not in rgts:
-                    continue
-                
-                filtered_granules.append(granule)
-                
-        except (ValueError, IndexError) as e:
-            print(f"Warning: Could not parse granule UR {granule_ur}: {e}")
-            continue
-    
+                bbox_dict = bounding_rectangles[0]
+                rect_bounds.append((
+                    bbox_dict.get("WestBoundingCoordinate", 0),
+                    bbox_dict.get("SouthBoundingCoordinate", 0),
+                    bbox_dict.get("EastBoundingCoordinate", 0),
+                    bbox_dict.get("NorthBoundingCoordinate", 0),
+                ))
+                rect_rows.append(len(granule_ids))
+            
+            # Get temporal info
+            temporal = umm.get("TemporalExtent", {})
+            range_date_times = temporal.get("RangeDateTime", {})
+            begin_date = range_date_times.get("BeginningDateTime", "")
+            end_date = range_date_times.get("EndingDateTime", "")
+            
+            # Get URLs from related URLs
+            related_urls = umm.get("RelatedUrls", [])
+            data_urls = []
+            for url_obj in related_urls:
+                url_type = url_obj.get("Type", "")
+                if "GET DATA" in url_type:
+                    data_urls.append(url_obj.get("URL", ""))
+            
+            granule_ids.append(granule_id)
+            granule_rgts.append(page_rgts[k])
+            granule_cycles.append(page_cycles[k])
+            granule_regions.append(page_regions[k])
+            begin_dates.append(begin_date)
+            end_dates.append(end_date)
+            url_lists.append(data_urls)
+
     filter_desc = []
     if cycle is not None:
         filter_desc.append(f"cycle {cycle}")
@@ -210,151 +394,66 @@ def query_atl06_cmr(
         filter_desc.append(f"RGTs {rgts}")
 
     if filter_desc:
-        print(f"Filtered to {len(filtered_granules)} granules matching {' and '.join(filter_desc)}")
+        print(f"Filtered to {n_matched} granules matching {' and '.join(filter_desc)}")
     else:
-        print(f"Found {len(filtered_granules)} granules")
+        print(f"Found {n_matched} granules")
     
-    # Convert to GeoDataFrame
-    records = []
-    for granule in filtered_granules:
-        umm = granule.get("umm", {})
-        
-        # Get granule ID
-        granule_id = umm.get("GranuleUR", "")
-        
-        # Get bounding box from spatial extent
-        spatial_extent = umm.get("SpatialExtent", {})
-        horiz_spatial = spatial_extent.get("HorizontalSpatialDomain", {})
-        geometry_obj = horiz_spatial.get("Geometry", {})
-
-        # Try to get geometry from GPolygons (UMM-JSON format)
-        gpolygons = geometry_obj.get("GPolygons", [])
-        if gpolygons:
-            # Get polygon points
-            boundary_points = gpolygons[0].get("Boundary", {}).get("Points", [])
-            if not boundary_points:
-                continue
-
-            # Extract coordinates
-            coords = [(p["Longitude"], p["Latitude"]) for p in boundary_points
-                      if "Longitude" in p and "Latitude" in p]
-
-            if len(coords) < 3:
-                continue
-
-            # Create polygon (actual ground track coverage)
-            polygon = Polygon(coords)
-
-            # Get bounding box coordinates for metadata
-            west, south, east, north = polygon.bounds
-
-            # Choose geometry based on user preference
-            if geometry_type == "bbox":
-                # Convert to bounding box
-                geom = box(west, south, east, north)
-            elif geometry_type == "centerline":
-                # Extract centerline from polygon
-                # Simple method: connect midpoints of polygon segments
-                n_points = len(coords)
-                if n_points > 4:
-                    # For complex polygons, compute centerline
-                    centerline_points = []
-                    half = n_points // 2
-                    for i in range(half):
-                        pt1 = coords[i]
-                        pt2 = coords[n_points - 1 - i]
-                        mid = ((pt1[0] + pt2[0])/2, (pt1[1] + pt2[1])/2)
-                        centerline_points.append(mid)
-                    geom = LineString(centerline_points)
-                else:
-                    # Simple polygon - just connect opposite midpoints
-                    geom = LineString([
-                        ((coords[0][0] + coords[2][0])/2, (coords[0][1] + coords[2][1])/2),
-                        ((coords[1][0] + coords[3][0])/2, (coords[1][1] + coords[3][1])/2)
-                    ])
-            else:  # Default to polygon
-                geom = polygon
-        else:
-            # Fallback to BoundingRectangles if available
-            bounding_rectangles = geometry_obj.get("BoundingRectangles", [])
-            if not bounding_rectangles:
-                continue
-
-            bbox_dict = bounding_rectangles[0]
-            west = bbox_dict.get("WestBoundingCoordinate", 0)
-            south = bbox_dict.get("SouthBoundingCoordinate", 0)
-            east = bbox_dict.get("EastBoundingCoordinate", 0)
-            north = bbox_dict.get("NorthBoundingCoordinate", 0)
-
-            # Create geometry (bbox since no polygon available)
-            geom = box(west, south, east, north)
-        
-        # Get temporal info
-        temporal = umm.get("TemporalExtent", {})
-        range_date_times = temporal.get("RangeDateTime", {})
-        begin_date = range_date_times.get("BeginningDateTime", "")
-        end_date = range_date_times.get("EndingDateTime", "")
-        
-        # Get URLs from related URLs
-        related_urls = umm.get("RelatedUrls", [])
-        data_urls = []
-        for url_obj in related_urls:
-            url_type = url_obj.get("Type", "")
-            if "GET DATA" in url_type:
-                data_urls.append(url_obj.get("URL", ""))
-        
-        # Parse granule components from filename
-        parts = granule_id.split("_")
-        rgt_cycle_region = parts[2] if len(parts) > 2 else ""
-        granule_rgt = int(rgt_cycle_region[0:4]) if len(rgt_cycle_region) >= 4 else None
-        granule_cycle = int(rgt_cycle_region[4:6]) if len(rgt_cycle_region) >= 6 else None
-        granule_region = int(rgt_cycle_region[6:8]) if len(rgt_cycle_region) >= 8 else None
-
-        record = {
-            "granule_id": granule_id,
-            "rgt": granule_rgt,
-            "cycle": granule_cycle,
-            "region": granule_region,
-            "bbox_west": west,
-            "bbox_south": south,
-            "bbox_east": east,
-            "bbox_north": north,
-            "geometry": geom,
-            "begin_datetime": begin_date,
-            "end_datetime": end_date,
-            "urls": data_urls,
-            "n_urls": len(data_urls),
-        }
-        records.append(record)
-    
-    # Create GeoDataFrame
-    if records:
-        gdf = gpd.GeoDataFrame(records, crs="EPSG:4326")
-    else:
-        # Create an empty GeoDataFrame with the expected schema
-        gdf = gpd.GeoDataFrame(
-            columns=[
-                "granule_id", "rgt", "cycle", "region",
-                "bbox_west", "bbox_south", "bbox_east", "bbox_north",
-                "geometry", "begin_datetime", "end_datetime",
-                "urls", "n_urls"
+    geometries = np.empty(len(granule_ids), dtype=object)
+    bounds = np.empty((len(granule_ids), 4))
+
+    if ring_rows:
+        ring_coords = np.asarray(ring_coords, dtype=np.float64)
+        ring_index = np.asarray(ring_index)
+        starts = np.searchsorted(ring_index, np.arange(len(ring_rows) + 1))
+
+        # Bounds come straight from the boundary points, so only the
+        # polygon mode pays for building polygons
+        bounds[ring_rows, :2] = np.minimum.reduceat(ring_coords, starts[:-1])
+        bounds[ring_rows, 2:] = np.maximum.reduceat(ring_coords, starts[:-1])
+
+        # Choose geometry based on user preference
+        if geometry_type == "bbox":
+            geometries[ring_rows] = shapely.box(*bounds[ring_rows].T)
+        elif geometry_type == "centerline":
+            geometries[ring_rows] = [
+                _centerline(ring_coords[lo:hi]) for lo, hi in zip(starts[:-1], starts[1:])
             ]
-        )
-        # Set geometry column and CRS
-        gdf = gdf.set_geometry("geometry")
-        gdf.set_crs("EPSG:4326", inplace=True, allow_override=True)
+        else:  # Default to polygon: actual ground track coverage
+            geometries[ring_rows] = shapely.polygons(
+                shapely.linearrings(ring_coords, indices=ring_index)
+            )
+
+    if rect_rows:
+        # Bounding box, since no polygon is available
+        rect_bounds = np.asarray(rect_bounds, dtype=np.float64)
+        bounds[rect_rows] = rect_bounds
+        geometries[rect_rows] = shapely.box(*rect_bounds.T)
+
+    # Create GeoDataFrame. The geometry column is handed over as a ready
+    # GeometryArray carrying the cached CRS, and the same construction
+    # gives an empty frame with the expected schema when nothing matched.
+    gdf = gpd.GeoDataFrame(
+        {
+            "granule_id": granule_ids,
+            "rgt": granule_rgts,
+            "cycle": granule_cycles,
+            "region": granule_regions,
+            "bbox_west": bounds[:, 0],
+            "bbox_south": bounds[:, 1],
+            "bbox_east": bounds[:, 2],
+            "bbox_north": bounds[:, 3],
+            "geometry": gpd.array.from_shapely(geometries, crs=_CRS_4326),
+            "begin_datetime": begin_dates,
+            "end_datetime": end_dates,
+            "urls": url_lists,
+            "n_urls": [len(urls) for urls in url_lists],
+        },
+        copy=False,
+    )
 
     return gdf
 
 
-def save_to_geoparquet(gdf: gpd.GeoDataFrame, output_path: str):
-    """Save GeoDataFrame to GeoParquet format."""
-    gdf_copy = gdf.copy()
-    gdf_copy["urls"] = gdf_copy["urls"].apply(lambda x: "|".join(x) if x else "")
-    gdf_copy.to_parquet(output_path, index=False)
-    print(f"\nSaved {len(gdf_copy)} records to {output_path}")
-
-
 if __name__ == "__main__":
     # Query for cycle 22, regions 10-12
     cycle = 22
@@ -7,9 +7,12 @@ Output as a STAC catalog that can be saved as GeoParquet.
 import pystac_client
 import geopandas as gpd
 from shapely.geometry import box
+import numpy as np
 import pandas as pd
 from typing import List, Optional
 
+from atl06_granules import parse_granule_urs, save_to_geoparquet
+
 
 def query_atl06_stac(
     cycle: int,
@@ -85,31 +88,14 @@ def query_atl06_stac(
     # ATL06 filename format: ATL06_YYYYMMDDhhmmss_ttttccnn_rrr_vv.h5
     # where: tttt=RGT, cc=cycle, nn=granule region number
     
-    filtered_items = []
-    for item in items:
-        granule_id = item.id
-        
-        # Parse filename components
-        # Example: ATL06_20231218120000_0010_22_10_006_01.h5
-        # Or without .h5: ATL06_20231218120000_001022101_006_01
-        try:
-            parts = granule_id.split("_")
-            if len(parts) >= 3:
-                # The RGT+cycle+region is typically in parts[2]
-                rgt_cycle_region = parts[2]
-                
-                # Extract cycle (positions 4-5, 0-indexed)
-                granule_cycle = int(rgt_cycle_region[4:6])
-                
-                # Extract region (positions 6-7, 0-indexed)
-                granule_region = int(rgt_cycle_region[6:8])
-                
-                # Filter by cycle and region
-                if granule_cycle == cycle and granule_region in regions:
-                    filtered_items.append(item)
-        except (ValueError, IndexError) as e:
-            print(f"Warning: Could not parse granule ID {granule_id}: {e}")
-            continue
+    granule_ids = [item.id for item in items]
+    _, granule_cycles, granule_regions, parsed = parse_granule_urs(granule_ids)
+    for k in np.flatnonzero(~parsed):
+        print(f"Warning: Could not parse granule ID {granule_ids[k]}")
+
+    # Filter by cycle and region
+    keep = parsed & (granule_cycles == cycle) & np.isin(granule_regions, list(regions))
+    filtered_items = [items[k] for k in np.flatnonzero(keep)]
     
     print(f"Filtered to {len(filtered_items)} granules matching cycle {cycle} and regions {regions}")
     
@@ -148,25 +134,6 @@ def query_atl06_stac(
     return gdf
 
 
-def save_to_geoparquet(gdf: gpd.GeoDataFrame, output_path: str):
-    """
-    Save GeoDataFrame to GeoParquet format.
-    
-    Parameters
-    ----------
-    gdf : gpd.GeoDataFrame
-        GeoDataFrame to save
-    output_path : str
-        Output file path (should end in .parquet or .geoparquet)
-    """
-    # URLs are lists, need to convert to string for parquet
-    gdf_copy = gdf.copy()
-    gdf_copy["urls"] = gdf_copy["urls"].apply(lambda x: "|".join(x) if x else "")
-    
-    gdf_copy.to_parquet(output_path, index=False)
-    print(f"\nSaved {len(gdf_copy)} records to {output_path}")
-
-
 if __name__ == "__main__":
     # Example usage
     cycle = 22